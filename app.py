@@ -7,15 +7,22 @@ Dashboard de Métricas de Emails — versión optimizada con DuckDB 🦆
 """
 
 import os
-import re
+import json
+import threading
+import time
+import urllib.request
 import duckdb
 from datetime import date
 import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
 
 import dash
-from dash import dcc, html, Input, Output, State, dash_table
+from dash import dcc, html, Input, Output, State, Patch, dash_table
 import dash_bootstrap_components as dbc
 import plotly.express as px
+from flask_caching import Cache
 
 # ================== Config ==================
 DATASET_URL = os.getenv(
@@ -25,43 +32,161 @@ DATASET_URL = os.getenv(
 DATE_COLUMN = os.getenv("DATE_COLUMN", "Fecha_de_creacion")
 EMAIL_COLUMN = os.getenv("EMAIL_COLUMN", "Email")
 
-EMAIL_REGEX = re.compile(r"^[A-Za-z0-9._%+\-']+@[A-Za-z0-9.\-]+\.[A-Za-z]{2,}$")
+CACHE_DIR = os.getenv("CACHE_DIR", "/tmp/dash_cache")
+CACHE_TIMEOUT = int(os.getenv("CACHE_TIMEOUT", "3600"))  # segundos
+# Archivo publicado junto al dataset remoto (p.ej. su metrics_summary.json): su
+# ETag / Last-Modified versiona la caché. Vacío: mtime del resumen local.
+DATA_VERSION_URL = os.getenv("DATA_VERSION_URL", "")
+DATA_VERSION_TTL = int(os.getenv("DATA_VERSION_TTL", "300"))  # segundos entre comprobaciones (en segundo plano)
 
 # ================== DuckDB Helper ==================
-def query_duckdb(sql: str) -> pd.DataFrame:
-    con = duckdb.connect()
-    con.execute("INSTALL httpfs; LOAD httpfs;")
-    con.execute("SET enable_progress_bar = false;")
-    return con.execute(sql).fetchdf()
-
-def load_df_full(start=None, end=None):
+# Una sola conexión por proceso: httpfs se carga una vez, se reutilizan las
+# conexiones HTTP y los metadatos (footers) Parquet ya leídos entre consultas.
+CON = duckdb.connect(":memory:")
+CON.execute("SET enable_object_cache = true; SET enable_progress_bar = false;")
+_httpfs_lock = threading.Lock()
+_httpfs_loaded = False
+
+def ensure_httpfs():
+    # httpfs se carga en la primera consulta remota y no al importar: sin red (o sin
+    # poder descargar la extensión) la app arranca igual y el error sale en la consulta,
+    # que se reintenta en la siguiente.
+    global _httpfs_loaded
+    if _httpfs_loaded or "://" not in DATASET_URL:
+        return
+    with _httpfs_lock:
+        if _httpfs_loaded:
+            return
+        try:
+            CON.execute("INSTALL httpfs; LOAD httpfs;")
+            CON.execute("SET http_keep_alive = true;")
+        except duckdb.Error as e:
+            print(f"⚠️ No se pudo cargar httpfs: {e}")
+            raise
+        _httpfs_loaded = True
+
+def query_duckdb(sql: str, params=None) -> pd.DataFrame:
+    ensure_httpfs()
+    # Un cursor por consulta (los callbacks pueden correr en paralelo) sobre la misma base
+    with CON.cursor() as cur:
+        table = cur.execute(sql, params or []).fetch_arrow_table()
+    return table.to_pandas(types_mapper=pd.ArrowDtype)
+
+# Mismas reglas que add_email_columns del ETL, solo para datasets publicados sin
+# las columnas precalculadas (se evalúa con RE2 en DuckDB).
+EMAIL_REGEX = r"^[A-Za-z0-9._%+\-']+@[A-Za-z0-9.\-]+\.[A-Za-z]{2,}$"
+EMAIL_SELECT = "SELECT email_lower, is_valid_email, email_domain"
+# Blancos que quita utf8_trim_whitespace de Arrow (no solo los ASCII de \s en RE2)
+TRIM_CLASS = r"[\x{09}-\x{0D}\x{1C}-\x{20}\x{85}\x{A0}\x{1680}\x{2000}-\x{200A}\x{2028}\x{2029}\x{202F}\x{205F}\x{3000}]"
+EMAIL_SELECT_FALLBACK = f"""
+    SELECT lower(regexp_replace({EMAIL_COLUMN}, '^{TRIM_CLASS}+|{TRIM_CLASS}+$', '', 'g')) AS email_lower,
+           coalesce(regexp_full_match(email_lower, ?), false) AS is_valid_email,
+           CASE WHEN is_valid_email THEN split_part(email_lower, '@', 2) END AS email_domain
+"""
+_email_columns_ready = False
+
+def has_email_columns() -> bool:
+    # El dataset remoto puede ser anterior al ETL que precalcula las columnas de
+    # email: se comprueba el esquema hasta que aparecen (después ya no cambia).
+    global _email_columns_ready
+    if not _email_columns_ready:
+        ensure_httpfs()
+        with CON.cursor() as cur:
+            schema = cur.execute(
+                "DESCRIBE SELECT * FROM read_parquet(?, hive_partitioning = true)", [DATASET_URL]
+            ).fetchall()
+        _email_columns_ready = {"email_lower", "is_valid_email", "email_domain"} <= {row[0] for row in schema}
+        if not _email_columns_ready:
+            print(f"⚠️ Dataset sin columnas de email precalculadas: se calculan desde {EMAIL_COLUMN}")
+    return _email_columns_ready
+
+def _month_key(value) -> int:
+    d = date.fromisoformat(str(value)[:10])
+    return d.year * 100 + d.month
+
+def load_df_full(start=None, end=None, agency=None, dest=None, cond=None, localizador=None):
     print(f"🦆 Cargando datos desde DuckDB remoto... rango {start} → {end}")
 
-    where = []
+    # Todos los filtros van a DuckDB como parámetros: la fecha poda row groups por
+    # min/max y los ILIKE se evalúan columnar, así solo viajan las filas que pasan.
+    where, params = [], [DATASET_URL]
+    # year/month son columnas de partición (hive): filtrar sobre ellas descarta
+    # archivos completos antes de abrir sus footers.
     if start:
-        where.append(f"{DATE_COLUMN} >= '{start}'")
+        where += ["(year * 100 + month) >= ?", f"{DATE_COLUMN} >= CAST(? AS DATE)"]
+        params += [_month_key(start), str(start)[:10]]
     if end:
-        where.append(f"{DATE_COLUMN} <= '{end}'")
+        where += ["(year * 100 + month) <= ?", f"{DATE_COLUMN} <= CAST(? AS DATE)"]
+        params += [_month_key(end), str(end)[:10]]
+    for col, value in (("agency", agency), ("Destination", dest),
+                       ("condactivacion", cond), ("Localizador", localizador)):
+        if value:
+            where.append(f"{col} ILIKE ?")
+            params.append(f"%{value}%")
     where_clause = f"WHERE {' AND '.join(where)}" if where else ""
 
+    # Solo las columnas de email precalculadas en el ETL; el resto únicamente filtran
+    select = EMAIL_SELECT
+    if not has_email_columns():
+        select = EMAIL_SELECT_FALLBACK
+        params.insert(0, EMAIL_REGEX)
     sql = f"""
-        SELECT Email, agency, Destination, condactivacion, Localizador, {DATE_COLUMN}
-        FROM read_parquet('{DATASET_URL}')
+        {select}
+        FROM read_parquet(?, hive_partitioning = true)
         {where_clause}
     """
-    df = query_duckdb(sql)
-    df[DATE_COLUMN] = pd.to_datetime(df[DATE_COLUMN], errors="coerce").dt.date
-    return df
+    return query_duckdb(sql, params)
 
 # ================== Archivos agregados (ligeros) ==================
-print("📥 Cargando métricas agregadas...")
-metrics_daily = pd.read_parquet("data/metrics_daily.parquet")
-metrics_daily["metric_date"] = pd.to_datetime(metrics_daily["metric_date"]).dt.date
-top_domains_daily = pd.read_parquet("data/metrics_top_domains_daily.parquet")
-repeated_hist = pd.read_parquet("data/metrics_repeated_emails.parquet")
+def read_parquet(path: str, columns=None, types_mapper=pd.ArrowDtype) -> pd.DataFrame:
+    # pyarrow directo: solo las columnas pedidas y liberando buffers Arrow durante la conversión
+    table = pq.read_table(path, columns=columns, use_threads=True)
+    return table.to_pandas(self_destruct=True, split_blocks=True, types_mapper=types_mapper)
 
-date_min = metrics_daily["metric_date"].min()
-date_max = metrics_daily["metric_date"].max()
+print("📥 Cargando métricas agregadas...")
+# Plotly no acepta date32 de Arrow en el eje x: dtypes numpy (fechas como date)
+metrics_daily_long = read_parquet("data/metrics_daily_long.parquet", types_mapper=None)
+top_domains_total = read_parquet("data/metrics_top_domains_total.parquet", columns=["domain", "cnt"])
+repeated_hist = read_parquet(
+    "data/metrics_repeated_emails_top.parquet",
+    columns=["email", "occurrences", "first_seen", "last_seen"],
+    types_mapper=None,  # va completo a to_dict("records"), más rápido con dtypes numpy
+)
+with open("data/metrics_summary.json", encoding="utf-8") as f:
+    metrics_summary = json.load(f)
+# El ETL reescribe el resumen en cada corrida: sin DATA_VERSION_URL su mtime versiona
+# la caché en disco (exige publicar data/ y el dataset remoto a la vez).
+LOCAL_DATA_VERSION = os.path.getmtime("data/metrics_summary.json")
+
+def fetch_data_version():
+    # ETag / Last-Modified de DATA_VERSION_URL (HEAD); None si no se pudo consultar
+    try:
+        req = urllib.request.Request(DATA_VERSION_URL, method="HEAD")
+        with urllib.request.urlopen(req, timeout=5) as resp:
+            return resp.headers.get("ETag") or resp.headers.get("Last-Modified")
+    except OSError as e:
+        print(f"⚠️ No se pudo consultar la versión de los datos: {e}")
+        return None
+
+def refresh_data_version():
+    # Hilo de fondo: los callbacks nunca esperan el HEAD y solo este hilo lo hace.
+    # Si falla se mantiene la última versión conocida.
+    global _data_version
+    while True:
+        time.sleep(DATA_VERSION_TTL)
+        _data_version = fetch_data_version() or _data_version
+
+_data_version = LOCAL_DATA_VERSION
+if DATA_VERSION_URL:
+    # Primera consulta al arrancar, para no cachear con la versión local
+    _data_version = fetch_data_version() or LOCAL_DATA_VERSION
+    threading.Thread(target=refresh_data_version, name="data-version", daemon=True).start()
+
+def data_version():
+    return _data_version
+
+date_min = date.fromisoformat(metrics_summary["first"])
+date_max = date.fromisoformat(metrics_summary["last"])
 
 # ================== UI Helpers ==================
 def kpi_card(value, title, color="dark"):
@@ -85,39 +210,56 @@ def kpi_card(value, title, color="dark"):
         className=f"{bg_colors.get(color, 'bg-dark')} text-center border-0 rounded-3 shadow-sm"
     )
 
-def bar_percentages(total, with_email, valid, uniques, sendable):
-    cats = [
-        "Total (100%)",
-        "Con email (% total)",
-        "Válidos (% con email)",
-        "Únicos (% total)",
-        "Enviables (% total)",
-    ]
-    vals = [
+PERC_CATEGORIES = [
+    "Total (100%)",
+    "Con email (% total)",
+    "Válidos (% con email)",
+    "Únicos (% total)",
+    "Enviables (% total)",
+]
+DQ_NAMES = ["ok", "duplicate", "empty", "invalid_format"]
+
+def perc_values(total, with_email, valid, uniques, sendable):
+    return [
         100 if total else 0,
         (with_email / total * 100) if total else 0,
         (valid / with_email * 100) if with_email else 0,
         (uniques / total * 100) if total else 0,
         (sendable / total * 100) if total else 0,
     ]
-    fig = px.bar(x=cats, y=vals, title="Volumen del día (porcentajes)")
+
+def bar_percentages(total, with_email, valid, uniques, sendable):
+    vals = perc_values(total, with_email, valid, uniques, sendable)
+    fig = px.bar(x=PERC_CATEGORIES, y=vals, title="Volumen del día (porcentajes)")
     fig.update_traces(text=[f"{v:.1f}%" for v in vals], textposition="outside")
     fig.update_layout(yaxis_title=None, xaxis_title=None, uniformtext_minsize=10, uniformtext_mode="hide")
     return fig
 
 def dq_pie(ok, duplicate, empty, invalid):
-    names = ["ok", "duplicate", "empty", "invalid_format"]
     vals  = [ok, duplicate, empty, invalid]
-    fig = px.pie(names=names, values=vals, title="Razones DQ (del rango)")
+    fig = px.pie(names=DQ_NAMES, values=vals, title="Razones DQ (del rango)")
     return fig
 
+def top_domains_bar(top_domains):
+    return px.bar(top_domains, x="domain", y="count", title="Top dominios (enviables del rango)")
+
+def duplicates_bar(top_duplicates):
+    return px.bar(top_duplicates, x="occurrences", y="email", orientation="h", title="Correos duplicados (rango)")
+
 # ================== App ==================
 app = dash.Dash(__name__, external_stylesheets=[dbc.themes.CYBORG])
 server = app.server
+cache = Cache(server, config={
+    "CACHE_TYPE": "FileSystemCache",
+    "CACHE_DIR": CACHE_DIR,
+    "CACHE_DEFAULT_TIMEOUT": CACHE_TIMEOUT,
+})
 app.title = "📊 Dashboard de Métricas de Emails"
 
 # ================== Layout ==================
 filter_layout = dbc.Container([
+    dcc.Store(id="filtered-agg"),
+
     dbc.Row([
         dbc.Col([html.Label("Agency"), dcc.Input(id="agency-filter", placeholder="Ej: BDR_ROYALTON", type="text", style={"width": "100%"})], md=3),
         dbc.Col([html.Label("Destination"), dcc.Input(id="destination-filter", placeholder="Ej: Cancún", type="text", style={"width": "100%"})], md=3),
@@ -149,29 +291,31 @@ filter_layout = dbc.Container([
         dbc.Col(dbc.Placeholder(id="kpi-unique-sendable", style={"height": 90}, color="secondary"), md=2),
     ], className="mb-3"),
 
+    # Figuras base vacías: los callbacks solo parchean los datos de la traza (Patch)
+    # en lugar de reenviar la figura completa en cada clic.
     dbc.Row([
-        dbc.Col(dcc.Graph(id="filtered-perc-bar"), md=6),
-        dbc.Col(dcc.Graph(id="filtered-dq-pie"), md=6),
+        dbc.Col(dcc.Graph(id="filtered-perc-bar", figure=bar_percentages(0, 0, 0, 0, 0)), md=6),
+        dbc.Col(dcc.Graph(id="filtered-dq-pie", figure=dq_pie(0, 0, 0, 0)), md=6),
     ], className="mb-3"),
     dbc.Row([
-        dbc.Col(dcc.Graph(id="filtered-top-domains"), md=6),
-        dbc.Col(dcc.Graph(id="filtered-duplicated-emails"), md=6),
+        dbc.Col(dcc.Graph(id="filtered-top-domains", figure=top_domains_bar({"domain": [], "count": []})), md=6),
+        dbc.Col(dcc.Graph(id="filtered-duplicated-emails", figure=duplicates_bar({"email": [], "occurrences": []})), md=6),
     ]),
 ], fluid=True)
 
 historico_layout = dbc.Container([
     html.Hr(),
     dbc.Row([
-        dbc.Col(kpi_card(int(metrics_daily["total_rows"].sum()), "Registros (histórico)", "blue"), md=2),
-        dbc.Col(kpi_card(int(metrics_daily["with_email"].sum()), "Con email (suma)", "green"), md=2),
-        dbc.Col(kpi_card(int(metrics_daily["valid_emails"].sum()), "Formato válido (suma)", "orange"), md=3),
-        dbc.Col(kpi_card(int(metrics_daily["sendable_emails"].sum()), "Enviables (suma)", "green"), md=3),
-        dbc.Col(kpi_card(int(metrics_daily["unique_valid_emails"].sum()), "Únicos válidos (suma)", "dark"), md=2),
+        dbc.Col(kpi_card(metrics_summary["total_rows"], "Registros (histórico)", "blue"), md=2),
+        dbc.Col(kpi_card(metrics_summary["with_email"], "Con email (suma)", "green"), md=2),
+        dbc.Col(kpi_card(metrics_summary["valid_emails"], "Formato válido (suma)", "orange"), md=3),
+        dbc.Col(kpi_card(metrics_summary["sendable_emails"], "Enviables (suma)", "green"), md=3),
+        dbc.Col(kpi_card(metrics_summary["unique_valid_emails"], "Únicos válidos (suma)", "dark"), md=2),
     ], className="mb-4"),
 
     dcc.Graph(
         figure=px.line(
-            metrics_daily.melt(id_vars=["metric_date"], var_name="variable", value_name="value"),
+            metrics_daily_long,
             x="metric_date", y="value", color="variable",
             title="Evolución de métricas diarias"
         )
@@ -181,18 +325,17 @@ historico_layout = dbc.Container([
 
     dcc.Graph(
         figure=px.bar(
-            top_domains_daily.groupby("domain", as_index=False)["cnt"].sum()
-                .sort_values("cnt", ascending=False).head(10),
+            top_domains_total,
             x="domain", y="cnt", title="Top 10 dominios más frecuentes (histórico)"
         )
     ),
 
     html.Br(),
 
-    html.H5("Emails repetidos (histórico total)"),
+    html.H5(f"Emails repetidos (histórico total, top {len(repeated_hist):,})"),
     dash_table.DataTable(
         columns=[{"name": c, "id": c} for c in ["email", "occurrences", "first_seen", "last_seen"]],
-        data=repeated_hist.sort_values("occurrences", ascending=False).to_dict("records"),
+        data=repeated_hist.to_dict("records"),
         page_size=10,
         style_table={"overflowX": "auto"},
         style_cell={"textAlign": "left", "backgroundColor": "#222", "color": "white"},
@@ -208,17 +351,60 @@ app.layout = dbc.Container([
     ])
 ], fluid=True)
 
-# ================== Callback ==================
+# ================== Cálculo (cacheado) ==================
+def _norm_filter(value):
+    value = (value or "").strip()
+    return value or None
+
+@cache.memoize()
+def compute_filtered(agency, dest, cond, localizador, start_date, end_date, data_version):
+    # Determinista en sus argumentos: se cachea por firma de filtros y versión de
+    # datos. Devuelve un resumen pequeño (contadores + tops) serializable a JSON
+    # para dcc.Store; las figuras se arman a partir de él en callbacks separados.
+    df_full = load_df_full(start_date, end_date, agency, dest, cond, localizador)
+
+    # email_lower / is_valid_email / email_domain vienen del ETL: aquí solo se cuenta.
+    emails = pa.array(df_full["email_lower"])
+    valid_arr = pa.array(df_full["is_valid_email"])
+
+    # Un solo value_counts; de ahí salen únicos, duplicados y el top.
+    dup_counts = pc.value_counts(pc.filter(emails, valid_arr))
+    counts = dup_counts.field("counts")
+    repeated = pc.greater(counts, 1)
+
+    # Sumas directas sobre los bitmaps de Arrow; vacíos e inválidos salen por
+    # diferencia (todo válido tiene email) sin construir más máscaras.
+    total = int(len(df_full))
+    with_email = pc.sum(pc.not_equal(emails, "")).as_py() or 0
+    valid = pc.sum(valid_arr).as_py() or 0
+    unique_sendable = len(dup_counts)
+
+    dom_vc = pc.value_counts(pc.filter(pa.array(df_full["email_domain"]), valid_arr))
+    # value_counts de Arrow no ordena. Empates desempatados por la clave: el top es
+    # determinista (sin parpadeo entre refrescos y agg == prev_agg sigue valiendo).
+    # Los duplicados se ordenan ya filtrados a los repetidos, no todos los únicos.
+    domains_tbl = pa.table({"domain": dom_vc.field("values"), "count": dom_vc.field("counts")})
+    top_domains = domains_tbl.sort_by([("count", "descending"), ("domain", "ascending")]).slice(0, 10)
+    dup_tbl = pa.table({"email": dup_counts.field("values"), "occurrences": counts}).filter(repeated)
+    top_duplicates = dup_tbl.sort_by([("occurrences", "descending"), ("email", "ascending")]).slice(0, 20)
+
+    return {
+        "total": total,
+        "with_email": with_email,
+        "valid": valid,
+        "sendable": valid,
+        "unique_sendable": unique_sendable,
+        "empty": total - with_email,
+        "invalid": with_email - valid,
+        # Filas extra más allá de la primera aparición (igual que duplicates_extra_rows del ETL)
+        "duplicate": valid - unique_sendable,
+        "top_domains": top_domains.to_pydict(),
+        "top_duplicates": top_duplicates.to_pydict(),
+    }
+
+# ================== Callbacks ==================
 @app.callback(
-    Output("kpi-total", "children"),
-    Output("kpi-with-email", "children"),
-    Output("kpi-valid", "children"),
-    Output("kpi-sendable", "children"),
-    Output("kpi-unique-sendable", "children"),
-    Output("filtered-perc-bar", "figure"),
-    Output("filtered-dq-pie", "figure"),
-    Output("filtered-top-domains", "figure"),
-    Output("filtered-duplicated-emails", "figure"),
+    Output("filtered-agg", "data"),
     Input("apply-filters", "n_clicks"),
     State("agency-filter", "value"),
     State("destination-filter", "value"),
@@ -226,59 +412,76 @@ app.layout = dbc.Container([
     State("localizador-filter", "value"),
     State("date-range", "start_date"),
     State("date-range", "end_date"),
+    State("filtered-agg", "data"),
 )
-def update_filtered(n, agency, dest, cond, localizador, start_date, end_date):
+def update_filtered(n, agency, dest, cond, localizador, start_date, end_date, prev_agg):
     if not n:
         raise dash.exceptions.PreventUpdate
 
-    df_full = load_df_full(start_date, end_date)
-
-    if agency:
-        df_full = df_full[df_full["agency"].astype(str).str.contains(agency, case=False, na=False)]
-    if dest:
-        df_full = df_full[df_full["Destination"].astype(str).str.contains(dest, case=False, na=False)]
-    if cond:
-        df_full = df_full[df_full["condactivacion"].astype(str).str.contains(cond, case=False, na=False)]
-    if localizador:
-        df_full = df_full[df_full["Localizador"].astype(str).str.contains(localizador, case=False, na=False)]
-
-    email_series = df_full[EMAIL_COLUMN].astype(str).str.strip()
-    has_email = email_series.ne("") & email_series.notna()
-    valid_format = has_email & email_series.str.match(EMAIL_REGEX)
-
-    dup_counts = email_series[valid_format].str.lower().value_counts()
-    dup_mask = email_series.str.lower().map(dup_counts).fillna(0) > 1
-
-    total = int(len(df_full))
-    with_email = int(has_email.sum())
-    valid = int(valid_format.sum())
-    sendable = int(valid)
-    unique_sendable = int(email_series[valid_format].str.lower().nunique())
-
-    empty_cnt   = int((~has_email).sum())
-    invalid_cnt = int((has_email & ~valid_format).sum())
-    duplicate_cnt = int(dup_mask.sum() - (dup_counts > 1).shape[0])
+    agg = compute_filtered(
+        _norm_filter(agency), _norm_filter(dest), _norm_filter(cond), _norm_filter(localizador),
+        start_date, end_date, data_version(),
+    )
+    # Mismo resultado que el anterior: no se dispara ninguna salida dependiente
+    if agg == prev_agg:
+        return dash.no_update
+    return agg
 
-    k1 = kpi_card(total, "Total registros", "blue")
-    k2 = kpi_card(with_email, "Con email", "blue")
-    k3 = kpi_card(valid, "Válidos", "blue")
-    k4 = kpi_card(sendable, "Enviables", "blue")
-    k5 = kpi_card(unique_sendable, "Únicos válidos", "blue")
+@app.callback(
+    Output("kpi-total", "children"),
+    Output("kpi-with-email", "children"),
+    Output("kpi-valid", "children"),
+    Output("kpi-sendable", "children"),
+    Output("kpi-unique-sendable", "children"),
+    Input("filtered-agg", "data"),
+)
+def update_kpis(agg):
+    if not agg:
+        raise dash.exceptions.PreventUpdate
 
-    fig_perc = bar_percentages(total, with_email, valid, unique_sendable, sendable)
-    fig_dq   = dq_pie(valid, duplicate_cnt, empty_cnt, invalid_cnt)
+    return (
+        kpi_card(agg["total"], "Total registros", "blue"),
+        kpi_card(agg["with_email"], "Con email", "blue"),
+        kpi_card(agg["valid"], "Válidos", "blue"),
+        kpi_card(agg["sendable"], "Enviables", "blue"),
+        kpi_card(agg["unique_sendable"], "Únicos válidos", "blue"),
+    )
 
-    dom = email_series[valid_format].str.split("@").str[-1]
-    dom_counts = dom.value_counts().head(10).reset_index()
-    dom_counts.columns = ["domain", "count"]
-    fig_domains = px.bar(dom_counts, x="domain", y="count", title="Top dominios (enviables del rango)")
+@app.callback(Output("filtered-perc-bar", "figure"), Input("filtered-agg", "data"))
+def update_perc_bar(agg):
+    if not agg:
+        raise dash.exceptions.PreventUpdate
+    vals = perc_values(agg["total"], agg["with_email"], agg["valid"], agg["unique_sendable"], agg["sendable"])
+    fig = Patch()
+    fig["data"][0]["y"] = vals
+    fig["data"][0]["text"] = [f"{v:.1f}%" for v in vals]
+    return fig
 
-    dup_top = dup_counts[dup_counts > 1].head(20).reset_index()
-    dup_top.columns = ["email", "occurrences"]
-    fig_dup = px.bar(dup_top, x="occurrences", y="email", orientation="h", title="Correos duplicados (rango)")
+@app.callback(Output("filtered-dq-pie", "figure"), Input("filtered-agg", "data"))
+def update_dq_pie(agg):
+    if not agg:
+        raise dash.exceptions.PreventUpdate
+    fig = Patch()
+    fig["data"][0]["values"] = [agg["valid"], agg["duplicate"], agg["empty"], agg["invalid"]]
+    return fig
 
-    return k1, k2, k3, k4, k5, fig_perc, fig_dq, fig_domains, fig_dup
+@app.callback(Output("filtered-top-domains", "figure"), Input("filtered-agg", "data"))
+def update_top_domains(agg):
+    if not agg:
+        raise dash.exceptions.PreventUpdate
+    fig = Patch()
+    fig["data"][0]["x"] = agg["top_domains"]["domain"]
+    fig["data"][0]["y"] = agg["top_domains"]["count"]
+    return fig
 
+@app.callback(Output("filtered-duplicated-emails", "figure"), Input("filtered-agg", "data"))
+def update_duplicates(agg):
+    if not agg:
+        raise dash.exceptions.PreventUpdate
+    fig = Patch()
+    fig["data"][0]["x"] = agg["top_duplicates"]["occurrences"]
+    fig["data"][0]["y"] = agg["top_duplicates"]["email"]
+    return fig
 
 if __name__ == "__main__":
     app.run_server(host="0.0.0.0", port=7860, debug=True)
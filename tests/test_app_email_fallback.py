@@ -0,0 +1,33 @@
+import duckdb
+import pyarrow as pa
+
+import app
+import update_metrics as um
+
+EMAILS = [
+    "User@Example.com",
+    "  spaced@example.com\t",
+    "businessonly198@gmail.com\xa0",
+    "　ideographic@example.jp ",
+    "nel@example.com\x85",
+    "zero-width@example.com​",
+    "no-es-un-email",
+    "dos@@example.com",
+    "",
+    "   ",
+    None,
+]
+
+
+def test_fallback_sql_matches_add_email_columns():
+    # Las columnas calculadas al vuelo deben coincidir con las precalculadas del ETL
+    table = pa.table({app.EMAIL_COLUMN: pa.array(EMAILS, type=pa.string())})
+    con = duckdb.connect()
+    con.register("emails", table)
+    fallback = con.execute(
+        f"{app.EMAIL_SELECT_FALLBACK} FROM emails", [app.EMAIL_REGEX]
+    ).fetch_arrow_table()
+
+    etl = um.add_email_columns(table.rename_columns(["Email"]))
+    for col in ("email_lower", "is_valid_email", "email_domain"):
+        assert fallback[col].to_pylist() == etl[col].to_pylist(), col
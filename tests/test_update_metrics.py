@@ -0,0 +1,85 @@
+import re
+from collections import defaultdict
+
+import pandas as pd
+import pyarrow.parquet as pq
+import pytest
+
+import update_metrics as um
+
+
+@pytest.fixture
+def etl_state(tmp_path, monkeypatch):
+    # Estado de módulo limpio por test y data_full en un directorio temporal
+    for name in ("daily_parts", "domain_parts", "email_parts", "pair_parts", "repeated_parts"):
+        monkeypatch.setattr(um, name, [])
+    monkeypatch.setattr(um, "export_buffers", defaultdict(list))
+    monkeypatch.setattr(um, "export_writers", {})
+    monkeypatch.setattr(um, "export_rows", defaultdict(int))
+    monkeypatch.setattr(um, "DATA_FULL_DIR", str(tmp_path / "data_full"))
+    return tmp_path
+
+
+def make_rows(n_days=40, per_day=60):
+    # Pocos emails repetidos entre días y dentro del mismo día, con mayúsculas,
+    # espacios y algún inválido; ordenado por fecha como el SELECT del ETL.
+    rows = []
+    start = pd.Timestamp("2024-05-20")
+    for d in range(n_days):
+        for i in range(per_day):
+            email = f"User{(d * 7 + i) % 23}@Example.com"
+            if i % 11 == 0:
+                email = f"  {email.lower()} "
+            if i % 17 == 0:
+                email = "no-es-un-email"
+            rows.append({
+                um.EMAIL_COLUMN: email,
+                um.DATE_COLUMN: start + pd.Timedelta(days=d, minutes=i),
+                "agency": f"ag{i % 3}",
+                "Destination": "CUN",
+                "condactivacion": "ok",
+                "Localizador": f"L{d}-{i}",
+            })
+    return pd.DataFrame(rows)
+
+
+def run_chunks(df, chunksize, start_ts=None, end_ts=None):
+    for idx, pos in enumerate(range(0, len(df), chunksize), start=1):
+        chunk = df.iloc[pos:pos + chunksize]
+        um.merge_partial(um.process_chunk(chunk, idx, start_ts, end_ts))
+    um.export_close()
+    return um.build_daily_df().set_index("metric_date")
+
+
+def direct_unique_per_day(df, start_ts, end_ts):
+    created = df[um.DATE_COLUMN]
+    in_range = df[(created >= start_ts) & (created <= end_ts)]
+    emails = in_range[um.EMAIL_COLUMN].str.strip().str.lower()
+    valid = emails.map(lambda e: re.match(um.EMAIL_REGEX, e) is not None)
+    return emails[valid].groupby(in_range[um.DATE_COLUMN].dt.date[valid]).nunique()
+
+
+def test_range_unique_emails_match_direct_count(etl_state):
+    df = make_rows()
+    start_ts, end_ts = pd.Timestamp("2024-06-03"), pd.Timestamp("2024-06-20")
+    # Chunks que no caen en frontera de día: un mismo día queda repartido
+    daily = run_chunks(df, chunksize=37, start_ts=start_ts, end_ts=end_ts)
+
+    assert daily.index.min() == start_ts.date() and daily.index.max() == end_ts.date()
+    expected = direct_unique_per_day(df, start_ts, end_ts).reindex(daily.index, fill_value=0)
+    assert daily["unique_valid_emails"].tolist() == expected.tolist()
+    assert (daily["duplicates_extra_rows"] == daily["valid_emails"] - daily["unique_valid_emails"]).all()
+
+
+def test_data_full_row_groups_do_not_overlap(etl_state, monkeypatch):
+    monkeypatch.setattr(um, "ROW_GROUP_SIZE", 100)
+    df = make_rows()
+    run_chunks(df, chunksize=37)
+
+    for part in sorted((etl_state / "data_full").glob("year=*/month=*/*.parquet")):
+        meta = pq.ParquetFile(part).metadata
+        col = meta.schema.names.index(um.DATE_COLUMN)
+        groups = [meta.row_group(i) for i in range(meta.num_row_groups)]
+        assert all(g.num_rows == 100 for g in groups[:-1])
+        for prev, cur in zip(groups, groups[1:]):
+            assert prev.column(col).statistics.max <= cur.column(col).statistics.min
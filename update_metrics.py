@@ -1,8 +1,8 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 """
-ETL: Lee tabla grande por chunks, calcula métricas diarias, guarda en MySQL y Parquet,
-y genera repeated_emails_daily.parquet + data_full.parquet para el dashboard.
+ETL: Lee tabla grande por chunks (una sola pasada), calcula métricas diarias, guarda en
+MySQL y Parquet, y genera repeated_emails_daily.parquet + data_full/ (particionado) para el dashboard.
 Uso:
     python update_metrics.py --full-rebuild
     python update_metrics.py --start 2025-09-01 --end 2025-09-30
@@ -10,12 +10,19 @@ Uso:
 
 import os
 import argparse
-import re
+import json
+import shutil
 import sys
+import tempfile
 from datetime import datetime
-from collections import defaultdict
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
 
 import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pa_csv
+import pyarrow.parquet as pq
 from sqlalchemy import create_engine, text
 from dotenv import load_dotenv
 
@@ -32,8 +39,38 @@ CLICKS_COLUMN = os.getenv("CLICKS_COLUMN", "")
 
 DATA_DIR = os.getenv("DATA_DIR", "data")
 CHUNKSIZE = int(os.getenv("CHUNKSIZE", "150000"))  # Ajusta según RAM
-
-EMAIL_REGEX = re.compile(r"^[A-Za-z0-9._%+\-']+@[A-Za-z0-9.\-]+\.[A-Za-z]{2,}$")
+ROW_GROUP_SIZE = int(os.getenv("ROW_GROUP_SIZE", "256000"))  # Filas por row group en data_full
+PIPELINE_WORKERS = int(os.getenv("PIPELINE_WORKERS", str(min(4, os.cpu_count() or 1))))  # Chunks procesados en paralelo
+REPEATED_TOP_K = int(os.getenv("REPEATED_TOP_K", "1000"))  # Emails repetidos que ve el dashboard
+DATA_FULL_DIR = os.path.join(DATA_DIR, "data_full")  # Dataset particionado year=YYYY/month=M
+
+# Opciones Parquet de los exports grandes: snappy (descompresión barata),
+# diccionario y estadísticas min/max para el pruning de row groups por fecha.
+PARQUET_OPTIONS = {
+    "compression": "snappy",
+    "use_dictionary": True,
+    "write_statistics": True,
+    "data_page_size": 1 << 20,
+}
+
+# Columnas de baja cardinalidad usadas como filtro en el dashboard
+CATEGORY_COLUMNS = ["agency", "Destination", "condactivacion"]
+# Columnas de detalle que se leen en la misma pasada para data_full
+DETAIL_COLUMNS = CATEGORY_COLUMNS + ["Localizador"]
+DETAIL_SCHEMA = pa.schema(
+    [("Email", pa.string())] + [(c, pa.string()) for c in DETAIL_COLUMNS] + [(DATE_COLUMN, pa.date32())]
+)
+# Esquema fijo de data_full (se escribe de forma incremental): columnas de
+# filtro como diccionario (códigos enteros) más las de email precalculadas.
+EXPORT_SCHEMA = pa.schema(
+    [pa.field(f.name, pa.dictionary(pa.int32(), pa.string())) if f.name in CATEGORY_COLUMNS else f
+     for f in DETAIL_SCHEMA]
+    + [("email_lower", pa.string()), ("is_valid_email", pa.bool_()),
+       ("email_domain", pa.dictionary(pa.int32(), pa.string()))]
+)
+
+# Se evalúa con el kernel RE2 de Arrow (match_substring_regex): sin backtracking
+EMAIL_REGEX = r"^[A-Za-z0-9._%+\-']+@[A-Za-z0-9.\-]+\.[A-Za-z]{2,}$"
 
 # ================== Helpers ==================
 def norm_col(col: str) -> str:
@@ -42,103 +79,303 @@ def norm_col(col: str) -> str:
 def ensure_dir(path: str):
     os.makedirs(path, exist_ok=True)
 
-def valid_email(e: str) -> bool:
-    return isinstance(e, str) and e.strip() and EMAIL_REGEX.match(e.strip())
+# ================== Aggregators ==================
+DAILY_METRICS = [
+    "total_rows",
+    "with_email",
+    "valid_emails",
+    "invalid_emails",
+    "duplicates_extra_rows",
+    "unique_valid_emails",
+    "sendable_emails",
+    "total_opens",
+    "total_clicks",
+]
+# Se suman por chunk; unique_valid_emails / duplicates_extra_rows no son sumables
+# (un mismo día puede repartirse entre chunks) y salen de build_daily_df.
+SUMMED_METRICS = [m for m in DAILY_METRICS if m not in ("unique_valid_emails", "duplicates_extra_rows")]
+
+# Parciales de cada chunk como tablas Arrow pequeñas; se reducen con un solo
+# group_by de Arrow al guardar en vez de dicts de Python con millones de claves.
+daily_parts = []
+domain_parts = []
+email_parts = []
+pair_parts = []  # pares (día, email válido) distintos de cada chunk
+repeated_parts = []
+
+def reduce_table(parts: list, keys: list, aggregations: dict) -> pa.Table:
+    # aggregations: {columna_salida: (columna, función)}
+    if not parts:
+        return pa.table({c: pa.array([]) for c in keys + list(aggregations)})
+    # use_threads=False: grupos en orden de primera aparición (salida determinista)
+    # (promote_options: un chunk sin filas trae columnas de tipo null)
+    out = (
+        pa.concat_tables(parts, promote_options="default")
+        .group_by(keys, use_threads=False)
+        .aggregate(list(aggregations.values()))
+    )
+    return (
+        out.select(keys + [f"{col}_{fn}" for col, fn in aggregations.values()])
+        .rename_columns(keys + list(aggregations))
+    )
 
-def email_domain(e: str) -> str | None:
-    try:
-        return e.split("@", 1)[1].lower().strip()
-    except Exception:
-        return None
+def reduce_parts(parts: list, keys: list, aggregations: dict) -> pd.DataFrame:
+    return reduce_table(parts, keys, aggregations).to_pandas()
+
+def chunk_metrics(chunk: pd.DataFrame, metric_day: pd.Series):
+    # strip / lower / regex con kernels de Arrow (RE2 en C++) en vez de re por fila
+    # Email nulo = vacío (misma regla que add_email_columns y el dashboard), no "None"
+    emails = pa.array(chunk[EMAIL_COLUMN], type=pa.string(), from_pandas=True)
+    email_lower = pc.utf8_lower(pc.utf8_trim_whitespace(emails))
+    chunk_lower = pd.Series(email_lower, index=chunk.index, dtype=pd.ArrowDtype(pa.string()))
+    has_email = pd.Series(pc.fill_null(pc.greater(pc.utf8_length(email_lower), 0), False), index=chunk.index, dtype=bool)
+    valid_mask = pd.Series(pc.fill_null(pc.match_substring_regex(email_lower, EMAIL_REGEX), False), index=chunk.index, dtype=bool)
+
+    # Flags por fila calculados una vez y agregados por día en un solo groupby
+    flags = pd.DataFrame({
+        "total_rows": 1,
+        "with_email": has_email,
+        "valid_emails": valid_mask,
+        "invalid_emails": has_email & ~valid_mask,
+        "total_opens": 0,
+        "total_clicks": 0,
+    }, index=chunk.index)
+    if OPENS_COLUMN and OPENS_COLUMN in chunk.columns:
+        flags["total_opens"] = pd.to_numeric(chunk[OPENS_COLUMN], errors="coerce").fillna(0)
+    if CLICKS_COLUMN and CLICKS_COLUMN in chunk.columns:
+        flags["total_clicks"] = pd.to_numeric(chunk[CLICKS_COLUMN], errors="coerce").fillna(0)
+    per_day = flags.groupby(metric_day, sort=False).sum()
+
+    per_day["sendable_emails"] = per_day["valid_emails"]
+
+    # Pares (día, email) distintos del chunk; los únicos por día se cuentan al
+    # final sobre todos los chunks (build_daily_df)
+    valid_pairs = pd.DataFrame({"d": metric_day[valid_mask], "e": chunk_lower[valid_mask]})
+    dated_pairs = valid_pairs.dropna()
+    distinct_pairs = dated_pairs.drop_duplicates()
+
+    valid_lower = pc.filter(email_lower, pa.array(valid_mask))
+    domains = pd.DataFrame({
+        "d": valid_pairs["d"],
+        "dom": pd.Series(pc.list_element(pc.split_pattern(valid_lower, "@", max_splits=1), 1),
+                         index=valid_pairs.index, dtype=pd.ArrowDtype(pa.string())),
+    })
+    domain_counts = domains.groupby(["d", "dom"], sort=False).size()
+
+    # Conteo / primera / última aparición por email en un solo groupby del chunk
+    # (sobre datetime64: min/max de objetos date en groupby caen a Python)
+    email_agg = dated_pairs.groupby("e", sort=False)["d"].agg(["count", "min", "max"])
+
+    per_day.index = per_day.index.date
+    domain_counts.index = domain_counts.index.set_levels(domain_counts.index.levels[0].date, level=0)
+    return (
+        pa.Table.from_pandas(per_day[SUMMED_METRICS].rename_axis("metric_date").reset_index(), preserve_index=False),
+        pa.Table.from_pandas(domain_counts.rename_axis(["metric_date", "domain"]).reset_index(name="cnt"), preserve_index=False),
+        pa.Table.from_pandas(
+            email_agg.rename_axis("email").reset_index()
+            .rename(columns={"count": "occurrences", "min": "first_seen", "max": "last_seen"})
+            .assign(first_seen=lambda df: df["first_seen"].dt.date, last_seen=lambda df: df["last_seen"].dt.date),
+            preserve_index=False,
+        ),
+        pa.table({
+            "metric_date": pc.cast(pa.array(distinct_pairs["d"]), pa.date32()),
+            "email": pa.array(distinct_pairs["e"]),
+        }),
+    )
 
-# ================== Aggregators ==================
-daily = defaultdict(lambda: {
-    "total_rows": 0,
-    "with_email": 0,
-    "valid_emails": 0,
-    "invalid_emails": 0,
-    "duplicates_extra_rows": 0,
-    "unique_valid_emails": 0,
-    "sendable_emails": 0,
-    "total_opens": 0,
-    "total_clicks": 0
-})
-
-domains_daily = defaultdict(lambda: defaultdict(int))
-email_global_counts = defaultdict(int)
-email_first_seen = {}
-email_last_seen  = {}
-
-def process_chunk(chunk: pd.DataFrame, idx: int):
+def chunk_detail(chunk: pd.DataFrame, created: pd.Series):
+    # Conteos por (email, filtros, día) y filas de data_full del chunk, con
+    # todas las filas con fecha (también las de meses completos fuera del rango).
+    metric_date = created.dt.date
+    rep = pd.DataFrame({
+        "email": chunk[EMAIL_COLUMN].str.lower(),
+        **{c: chunk[c] for c in DETAIL_COLUMNS},
+        "metric_date": metric_date,
+    })
+    # groupby descarta filas con claves nulas (email, filtros o fecha)
+    repeated_counts = rep.groupby(list(rep.columns), sort=False).size().reset_index(name="occurrences")
+
+    dated = created.notna()
+    detail = pd.DataFrame({
+        "Email": chunk[EMAIL_COLUMN],
+        **{c: chunk[c] for c in DETAIL_COLUMNS},
+        DATE_COLUMN: metric_date,
+    })[dated]
+    table = add_email_columns(pa.Table.from_pandas(detail, schema=DETAIL_SCHEMA, preserve_index=False))
+    partitions = {
+        (int(y), int(m)): table.take(pa.array(rows))
+        for (y, m), rows in pd.DataFrame({"y": created[dated].dt.year, "m": created[dated].dt.month})
+        .groupby(["y", "m"], sort=False).indices.items()
+    }
+    return pa.Table.from_pandas(repeated_counts, preserve_index=False), partitions
+
+def process_chunk(chunk: pd.DataFrame, idx: int, start_ts=None, end_ts=None):
+    # Sin estado global: devuelve agregados parciales del chunk para poder
+    # procesar varios chunks en paralelo y fusionarlos en el hilo principal.
     print(f"▶ Procesando chunk {idx:,} ({len(chunk):,} filas)...")
     if EMAIL_COLUMN not in chunk.columns or DATE_COLUMN not in chunk.columns:
         raise RuntimeError(f"Chunk sin columnas esperadas. Tiene: {chunk.columns}")
 
-    chunk[EMAIL_COLUMN] = chunk[EMAIL_COLUMN].astype(str).str.strip()
-    chunk["_metric_date"] = pd.to_datetime(chunk[DATE_COLUMN], errors="coerce").dt.date
-
-    for d, sub in chunk.groupby("_metric_date", dropna=True):
-        dkey = d
-        if pd.isna(dkey):
-            continue
-
-        daily[dkey]["total_rows"] += len(sub)
-
-        with_email = sub[sub[EMAIL_COLUMN].str.len() > 0]
-        daily[dkey]["with_email"] += len(with_email)
-
-        valid_mask = with_email[EMAIL_COLUMN].str.lower().str.match(EMAIL_REGEX)
-        valid_df = with_email[valid_mask].copy()
-        invalid_df = with_email[~valid_mask].copy()
-
-        daily[dkey]["valid_emails"] += len(valid_df)
-        daily[dkey]["invalid_emails"] += len(invalid_df)
-
-        vc = valid_df[EMAIL_COLUMN].str.lower().value_counts()
-        duplicates_extra = int((vc[vc > 1] - 1).sum()) if not vc.empty else 0
-        unique_valid = int(vc.shape[0]) if not vc.empty else 0
-
-        daily[dkey]["duplicates_extra_rows"] += duplicates_extra
-        daily[dkey]["unique_valid_emails"] += unique_valid
-        daily[dkey]["sendable_emails"] += len(valid_df)
-
-        if OPENS_COLUMN and OPENS_COLUMN in sub.columns:
-            daily[dkey]["total_opens"] += pd.to_numeric(sub[OPENS_COLUMN], errors="coerce").fillna(0).sum()
-        if CLICKS_COLUMN and CLICKS_COLUMN in sub.columns:
-            daily[dkey]["total_clicks"] += pd.to_numeric(sub[CLICKS_COLUMN], errors="coerce").fillna(0).sum()
+    created = pd.to_datetime(chunk[DATE_COLUMN], errors="coerce")
+    # El SELECT cubre meses completos; las métricas solo cuentan [start, end]
+    in_range = pd.Series(True, index=chunk.index)
+    if start_ts is not None:
+        in_range &= created >= start_ts
+    if end_ts is not None:
+        in_range &= created <= end_ts
+    metrics_chunk = chunk if in_range.all() else chunk[in_range]
+
+    return (
+        *chunk_metrics(metrics_chunk, created[metrics_chunk.index].dt.normalize()),
+        *chunk_detail(chunk, created),
+    )
 
-        if not valid_df.empty:
-            doms = valid_df[EMAIL_COLUMN].str.lower().map(email_domain).dropna()
-            for dom, cnt in doms.value_counts().items():
-                domains_daily[dkey][dom] += int(cnt)
+def merge_partial(partial):
+    # Solo desde el hilo principal; la reducción real se hace en flush_to_mysql
+    per_day, domain_counts, email_agg, pairs, repeated_counts, partitions = partial
+    daily_parts.append(per_day)
+    domain_parts.append(domain_counts)
+    email_parts.append(email_agg)
+    pair_parts.append(pairs)
+    repeated_parts.append(repeated_counts)
+    for key, table in partitions.items():
+        export_append(key, table)
+
+def add_email_columns(table: pa.Table) -> pa.Table:
+    # Validación y dominio precalculados: el dashboard solo cuenta booleanos
+    email_lower = pc.utf8_lower(pc.utf8_trim_whitespace(table["Email"]))
+    is_valid = pc.fill_null(pc.match_substring_regex(email_lower, EMAIL_REGEX), False)
+    domain = pc.struct_field(pc.extract_regex(email_lower, r"@(?P<domain>[^@]+)$"), [0])
+    domain = pc.if_else(is_valid, domain, pa.scalar(None, pa.string()))
+    return (
+        table.append_column("email_lower", email_lower)
+        .append_column("is_valid_email", is_valid)
+        .append_column("email_domain", domain.dictionary_encode())
+    )
 
-    valid_all = chunk[chunk[EMAIL_COLUMN].str.lower().str.match(EMAIL_REGEX)].copy()
-    for _, row in valid_all[[EMAIL_COLUMN, "_metric_date"]].dropna().iterrows():
-        e = str(row[EMAIL_COLUMN]).lower().strip()
-        dt = row["_metric_date"]
-        email_global_counts[e] += 1
-        if e not in email_first_seen or dt < email_first_seen[e]:
-            email_first_seen[e] = dt
-        if e not in email_last_seen or dt > email_last_seen[e]:
-            email_last_seen[e] = dt
+# ================== Export data_full ==================
+# Un ParquetWriter por partición (year, month) abierto durante la pasada por
+# chunks. El SELECT viene ordenado por fecha y los chunks se fusionan en orden,
+# así que cada partición recibe sus filas ya ordenadas: se vuelcan solo row groups
+# completos de ROW_GROUP_SIZE (el resto espera en el buffer) y sus min/max de fecha
+# no se solapan, que es lo que aprovecha el pruning del dashboard.
+export_buffers = defaultdict(list)
+export_writers = {}
+export_rows = defaultdict(int)
+
+def export_write(key, table: pa.Table):
+    for c in CATEGORY_COLUMNS:
+        table = table.set_column(table.schema.get_field_index(c), c, pc.dictionary_encode(table[c]))
+    if key not in export_writers:
+        # Reemplaza la partición completa (equivalente a delete_matching)
+        year, month = key
+        part_dir = os.path.join(DATA_FULL_DIR, f"year={year}", f"month={month}")
+        shutil.rmtree(part_dir, ignore_errors=True)
+        ensure_dir(part_dir)
+        export_writers[key] = pq.ParquetWriter(os.path.join(part_dir, "part-0.parquet"), EXPORT_SCHEMA, **PARQUET_OPTIONS)
+    export_writers[key].write_table(table.cast(EXPORT_SCHEMA), row_group_size=ROW_GROUP_SIZE)
+
+def export_append(key, table: pa.Table):
+    export_buffers[key].append(table)
+    export_rows[key] += table.num_rows
+    buffered = sum(t.num_rows for t in export_buffers[key])
+    if buffered >= ROW_GROUP_SIZE:
+        table = pa.concat_tables(export_buffers.pop(key))
+        full = buffered - buffered % ROW_GROUP_SIZE
+        export_write(key, table.slice(0, full))
+        if full < buffered:
+            export_buffers[key].append(table.slice(full))
+
+def export_close() -> int:
+    for key in list(export_buffers):
+        export_write(key, pa.concat_tables(export_buffers.pop(key)))
+    for writer in export_writers.values():
+        writer.close()
+    return sum(export_rows.values())
+
+def write_metrics_summary(daily_df: pd.DataFrame):
+    # Totales del histórico ya sumados: el dashboard los lee sin recorrer metrics_daily
+    summary = {
+        col: int(daily_df[col].sum())
+        for col in ["total_rows", "with_email", "valid_emails", "sendable_emails", "unique_valid_emails"]
+    }
+    summary["first"] = daily_df["metric_date"].min().isoformat()
+    summary["last"] = daily_df["metric_date"].max().isoformat()
+    summary["days"] = int(len(daily_df))
+    with open(os.path.join(DATA_DIR, "metrics_summary.json"), "w", encoding="utf-8") as f:
+        json.dump(summary, f, indent=2)
+
+def write_metrics_daily_long(daily_df: pd.DataFrame):
+    # Formato largo (metric_date, variable, value) listo para px.line, sin melt en el dashboard
+    daily_long = daily_df.melt(id_vars=["metric_date"], var_name="variable", value_name="value")
+    daily_long.to_parquet(os.path.join(DATA_DIR, "metrics_daily_long.parquet"), index=False)
+
+def write_dashboard_tops(mtd_df: pd.DataFrame, rep_table: pa.Table):
+    # Tops del histórico ya agregados y ordenados: el dashboard los pinta tal cual
+    if not mtd_df.empty:
+        top_domains = mtd_df.groupby("domain", as_index=False, sort=False)["cnt"].sum().nlargest(10, "cnt")
+        top_domains.to_parquet(os.path.join(DATA_DIR, "metrics_top_domains_total.parquet"), index=False)
+    if rep_table.num_rows:
+        # sort_by es estable: empates en el mismo orden que nlargest(keep="first")
+        top_repeated = rep_table.sort_by([("occurrences", "descending")]).slice(0, REPEATED_TOP_K)
+        pq.write_table(top_repeated, os.path.join(DATA_DIR, "metrics_repeated_emails_top.parquet"))
+
+def bulk_upsert(engine, df, tmp_table: str, target_table: str, upsert_sql: str):
+    # CSV + LOAD DATA LOCAL INFILE en una tabla temporal de la sesión (carga masiva
+    # del servidor en vez de un INSERT por fila de to_sql) y luego el upsert.
+    with tempfile.NamedTemporaryFile(suffix=".csv", delete=False) as f:
+        csv_path = f.name
+    if isinstance(df, pa.Table):
+        # Directo desde Arrow, sin pasar a pandas (solo tablas sin nulos: Arrow los deja vacíos)
+        pa_csv.write_csv(df, csv_path, pa_csv.WriteOptions(include_header=False))
+        columns = df.column_names
+    else:
+        df.to_csv(csv_path, index=False, header=False, na_rep="\\N", lineterminator="\n", encoding="utf-8")
+        columns = list(df.columns)
+    raw = engine.raw_connection()
+    try:
+        cur = raw.cursor()
+        cur.execute(f"CREATE TEMPORARY TABLE {tmp_table} LIKE {target_table}")
+        # La ruta va como parámetro del driver: queda escapada (barras invertidas de Windows, comillas)
+        cur.execute(f"""
+            LOAD DATA LOCAL INFILE %s INTO TABLE {tmp_table}
+            CHARACTER SET utf8mb4
+            FIELDS TERMINATED BY ',' OPTIONALLY ENCLOSED BY '"'
+            LINES TERMINATED BY '\\n'
+            ({", ".join(columns)})
+        """, (csv_path,))
+        cur.execute(upsert_sql)
+        raw.commit()
+    finally:
+        # También si algo falla: la conexión vuelve al pool sin la tabla temporal
+        try:
+            raw.cursor().execute(f"DROP TEMPORARY TABLE IF EXISTS {tmp_table}")
+        except Exception as e:
+            print(f"⚠️ No se pudo borrar {tmp_table}: {e}")
+        raw.close()
+        os.remove(csv_path)
+
+def build_daily_df() -> pd.DataFrame:
+    daily_df = reduce_parts(daily_parts, ["metric_date"], {m: (m, "sum") for m in SUMMED_METRICS})
+    # Únicos exactos por día: los pares distintos de cada chunk se reducen una vez
+    # sobre todo el SELECT; duplicados = válidos - únicos
+    unique = pd.Series(dtype="int64")
+    if pair_parts:
+        pairs = reduce_table(pair_parts, ["metric_date", "email"], {})
+        counts = pairs.group_by("metric_date", use_threads=False).aggregate([("email", "count")])
+        unique = pd.Series(counts["email_count"].to_numpy(), index=counts["metric_date"].to_pylist())
+    daily_df["unique_valid_emails"] = daily_df["metric_date"].map(unique).fillna(0).astype("int64")
+    daily_df["duplicates_extra_rows"] = daily_df["valid_emails"] - daily_df["unique_valid_emails"]
+    return daily_df[["metric_date", *DAILY_METRICS]].sort_values("metric_date")
 
 def flush_to_mysql(engine):
     print("💾 Guardando métricas en MySQL...")
 
-    daily_df = (
-        pd.DataFrame.from_dict(daily, orient="index")
-        .reset_index()
-        .rename(columns={"index": "metric_date"})
-        .sort_values("metric_date")
-    )
-    daily_df["metric_date"] = pd.to_datetime(daily_df["metric_date"]).dt.date
+    daily_df = build_daily_df()
 
     tmp_table = "tmp_metrics_daily"
-    with engine.begin() as conn:
-        print("  - Subiendo metrics_daily (tmp)...")
-        daily_df.to_sql(tmp_table, conn, if_exists="replace", index=False)
-        print("  - Haciendo upsert en metrics_daily...")
-        conn.execute(text(f"""
+    print("  - Subiendo metrics_daily (tmp) y haciendo upsert...")
+    bulk_upsert(engine, daily_df, tmp_table, "metrics_daily", f"""
             INSERT INTO metrics_daily
             (metric_date, total_rows, with_email, valid_emails, invalid_emails, duplicates_extra_rows,
              unique_valid_emails, sendable_emails, total_opens, total_clicks)
@@ -155,63 +392,52 @@ def flush_to_mysql(engine):
               sendable_emails=VALUES(sendable_emails),
               total_opens=VALUES(total_opens),
               total_clicks=VALUES(total_clicks);
-        """))
-        conn.execute(text(f"DROP TABLE {tmp_table}"))
+        """)
     print("✅ metrics_daily guardado")
 
-    rows = []
-    for d, doms in domains_daily.items():
-        for dom, cnt in doms.items():
-            rows.append({"metric_date": d, "domain": dom, "cnt": int(cnt)})
-    mtd_df = pd.DataFrame(rows)
+    mtd_df = reduce_parts(domain_parts, ["metric_date", "domain"], {"cnt": ("cnt", "sum")})
     if not mtd_df.empty:
         tmp_table = "tmp_metrics_top_domains_daily"
-        with engine.begin() as conn:
-            print("  - Guardando top dominios...")
-            mtd_df.to_sql(tmp_table, conn, if_exists="replace", index=False)
-            conn.execute(text(f"""
-                INSERT INTO metrics_top_domains_daily (metric_date, domain, cnt)
-                SELECT metric_date, domain, cnt
-                FROM {tmp_table}
-                ON DUPLICATE KEY UPDATE
-                  cnt=VALUES(cnt);
-            """))
-            conn.execute(text(f"DROP TABLE {tmp_table}"))
+        print("  - Guardando top dominios...")
+        bulk_upsert(engine, mtd_df, tmp_table, "metrics_top_domains_daily", f"""
+            INSERT INTO metrics_top_domains_daily (metric_date, domain, cnt)
+            SELECT metric_date, domain, cnt
+            FROM {tmp_table}
+            ON DUPLICATE KEY UPDATE
+              cnt=VALUES(cnt);
+        """)
         print("✅ Top dominios guardado")
 
-    rep_rows = []
-    for e, c in email_global_counts.items():
-        rep_rows.append({
-            "email": e,
-            "occurrences": int(c),
-            "first_seen": email_first_seen.get(e),
-            "last_seen": email_last_seen.get(e)
-        })
-    rep_df = pd.DataFrame(rep_rows)
-    if not rep_df.empty:
+    # Se queda en Arrow: sin DataFrame de millones de filas para el CSV ni el Parquet
+    rep_table = reduce_table(email_parts, ["email"], {
+        "occurrences": ("occurrences", "sum"),
+        "first_seen": ("first_seen", "min"),
+        "last_seen": ("last_seen", "max"),
+    })
+    if rep_table.num_rows:
         tmp_table = "tmp_metrics_repeated_emails"
-        with engine.begin() as conn:
-            print("  - Guardando emails repetidos...")
-            rep_df.to_sql(tmp_table, conn, if_exists="replace", index=False)
-            conn.execute(text(f"""
-                INSERT INTO metrics_repeated_emails (email, occurrences, first_seen, last_seen)
-                SELECT email, occurrences, first_seen, last_seen
-                FROM {tmp_table}
-                ON DUPLICATE KEY UPDATE
-                  occurrences=VALUES(occurrences),
-                  first_seen=LEAST(COALESCE(metrics_repeated_emails.first_seen, VALUES(first_seen)), VALUES(first_seen)),
-                  last_seen=GREATEST(COALESCE(metrics_repeated_emails.last_seen, VALUES(last_seen)), VALUES(last_seen));
-            """))
-            conn.execute(text(f"DROP TABLE {tmp_table}"))
+        print("  - Guardando emails repetidos...")
+        bulk_upsert(engine, rep_table, tmp_table, "metrics_repeated_emails", f"""
+            INSERT INTO metrics_repeated_emails (email, occurrences, first_seen, last_seen)
+            SELECT email, occurrences, first_seen, last_seen
+            FROM {tmp_table}
+            ON DUPLICATE KEY UPDATE
+              occurrences=VALUES(occurrences),
+              first_seen=LEAST(COALESCE(metrics_repeated_emails.first_seen, VALUES(first_seen)), VALUES(first_seen)),
+              last_seen=GREATEST(COALESCE(metrics_repeated_emails.last_seen, VALUES(last_seen)), VALUES(last_seen));
+        """)
         print("✅ Emails repetidos guardado")
 
     ensure_dir(DATA_DIR)
     print("💽 Guardando copias locales en Parquet...")
     daily_df.to_parquet(os.path.join(DATA_DIR, "metrics_daily.parquet"), index=False)
+    write_metrics_daily_long(daily_df)
+    write_metrics_summary(daily_df)
     if not mtd_df.empty:
         mtd_df.to_parquet(os.path.join(DATA_DIR, "metrics_top_domains_daily.parquet"), index=False)
-    if not rep_df.empty:
-        rep_df.to_parquet(os.path.join(DATA_DIR, "metrics_repeated_emails.parquet"), index=False)
+    if rep_table.num_rows:
+        pq.write_table(rep_table, os.path.join(DATA_DIR, "metrics_repeated_emails.parquet"))
+    write_dashboard_tops(mtd_df, rep_table)
     print("✅ Parquet guardado")
 
 def main():
@@ -226,78 +452,91 @@ def main():
         sys.exit(1)
 
     print("🚀 Iniciando ETL...")
-    engine = create_engine(DATABASE_URL, pool_pre_ping=True, pool_recycle=3600)
+    # local_infile: necesario para LOAD DATA LOCAL INFILE en bulk_upsert
+    engine = create_engine(DATABASE_URL, pool_pre_ping=True, pool_recycle=3600,
+                           connect_args={"local_infile": True})
     print("✅ Conectado a la base de datos")
 
-    where_clause = ""
-    params = {}
+    start_ts = end_ts = None
     if args.full_rebuild:
         print("📆 Procesando histórico completo")
     elif args.start and args.end:
-        where_clause = f"WHERE {norm_col(DATE_COLUMN)} BETWEEN :start AND :end"
-        params = {"start": args.start, "end": args.end}
+        start_ts, end_ts = pd.Timestamp(args.start), pd.Timestamp(args.end)
         print(f"📆 Procesando rango: {args.start} → {args.end}")
     elif args.start:
-        where_clause = f"WHERE {norm_col(DATE_COLUMN)} >= :start"
-        params = {"start": args.start}
+        start_ts = pd.Timestamp(args.start)
         print(f"📆 Procesando desde {args.start}")
     elif args.end:
-        where_clause = f"WHERE {norm_col(DATE_COLUMN)} <= :end"
-        params = {"end": args.end}
+        end_ts = pd.Timestamp(args.end)
         print(f"📆 Procesando hasta {args.end}")
 
+    # Una sola pasada: métricas y detalle de data_full salen del mismo SELECT.
+    # Se amplía a meses completos para reescribir enteras las particiones que
+    # toca; process_chunk limita las métricas a [start, end].
+    conditions = []
+    params = {}
+    if start_ts is not None:
+        conditions.append(f"{norm_col(DATE_COLUMN)} >= :export_start")
+        params["export_start"] = start_ts.to_period("M").start_time.to_pydatetime()
+    if end_ts is not None:
+        conditions.append(f"{norm_col(DATE_COLUMN)} < :export_end")
+        params["export_end"] = (end_ts.to_period("M") + 1).start_time.to_pydatetime()
+    where_clause = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+
     select_cols = [f"{norm_col(EMAIL_COLUMN)} AS email", f"{norm_col(DATE_COLUMN)} AS created_at"]
+    select_cols += [norm_col(c) for c in DETAIL_COLUMNS]
     if OPENS_COLUMN:
         select_cols.append(f"{norm_col(OPENS_COLUMN)} AS opens")
     if CLICKS_COLUMN:
         select_cols.append(f"{norm_col(CLICKS_COLUMN)} AS clicks")
 
-    sql = f"SELECT {', '.join(select_cols)} FROM {norm_col(TABLE_NAME)} {where_clause}"
+    # ORDER BY: data_full se escribe en orden de llegada (row groups sin solape por fecha)
+    sql = (
+        f"SELECT {', '.join(select_cols)} FROM {norm_col(TABLE_NAME)} {where_clause} "
+        f"ORDER BY {norm_col(DATE_COLUMN)}"
+    )
 
-    with engine.connect() as conn:
+    # Productor/consumidor: este hilo lee chunks de MySQL mientras los workers
+    # procesan los anteriores. Como mucho PIPELINE_WORKERS chunks en vuelo (RAM);
+    # los parciales se fusionan en orden de llegada del SELECT.
+    with engine.connect() as conn, ThreadPoolExecutor(max_workers=PIPELINE_WORKERS) as pool:
+        pending = deque()
         for i, chunk in enumerate(pd.read_sql(text(sql), conn, params=params, chunksize=CHUNKSIZE), start=1):
             chunk = chunk.rename(columns={"email": EMAIL_COLUMN, "created_at": DATE_COLUMN})
-            process_chunk(chunk, i)
+            pending.append(pool.submit(process_chunk, chunk, i, start_ts, end_ts))
+            while len(pending) > PIPELINE_WORKERS:
+                merge_partial(pending.popleft().result())
+        while pending:
+            merge_partial(pending.popleft().result())
+
+    print("📦 Cerrando data_full/ (detalle completo para dashboard, particionado por año/mes)...")
+    exported = export_close()
+    print(f"✅ data_full/ guardado ({exported:,} filas)")
 
     flush_to_mysql(engine)
 
     # ================== NUEVO BLOQUE: Parquets detallados ==================
     print("📌 Generando metrics_repeated_emails_daily.parquet con filtros adicionales...")
-    with engine.connect() as conn:
-        df_full = pd.read_sql(text(f"""
-            SELECT Email, agency, Destination, condactivacion, Localizador, {DATE_COLUMN}
-            FROM {TABLE_NAME}
-        """), conn)
-
-    df_full[DATE_COLUMN] = pd.to_datetime(df_full[DATE_COLUMN], errors="coerce")
-    df_full = df_full.dropna(subset=[DATE_COLUMN])
-
-    daily_df = (
-        df_full.groupby([
-            df_full["Email"].str.lower(),
-            "agency",
-            "Destination",
-            "condactivacion",
-            "Localizador",
-            df_full[DATE_COLUMN].dt.date
-        ])
-        .size()
-        .reset_index(name="occurrences")
-        .rename(columns={"Email": "email", DATE_COLUMN: "metric_date"})
+    repeated_path = os.path.join(DATA_DIR, "metrics_repeated_emails_daily.parquet")
+    daily_df = reduce_parts(
+        repeated_parts, ["email", *DETAIL_COLUMNS, "metric_date"], {"occurrences": ("occurrences", "sum")}
     )
-
-    daily_df.to_parquet(os.path.join(DATA_DIR, "metrics_repeated_emails_daily.parquet"), index=False)
+    if params and os.path.exists(repeated_path):
+        # Ejecución por rango: solo se sustituyen los meses leídos
+        previous = pd.read_parquet(repeated_path)
+        dates = pd.to_datetime(previous["metric_date"])
+        read_months = pd.Series(True, index=previous.index)
+        if "export_start" in params:
+            read_months &= dates >= params["export_start"]
+        if "export_end" in params:
+            read_months &= dates < params["export_end"]
+        daily_df = pd.concat([previous[~read_months], daily_df], ignore_index=True)
+    daily_df[CATEGORY_COLUMNS] = daily_df[CATEGORY_COLUMNS].astype("category")
+    daily_df = daily_df.sort_values("metric_date", kind="stable")
+
+    daily_df.to_parquet(repeated_path, index=False, row_group_size=ROW_GROUP_SIZE, **PARQUET_OPTIONS)
     print(f"✅ metrics_repeated_emails_daily.parquet guardado ({len(daily_df):,} filas)")
 
-    print("📦 Generando data_full.parquet (detalle completo para dashboard)...")
-    df_full_export = df_full[[
-        "Email", "agency", "Destination", "condactivacion", "Localizador", DATE_COLUMN
-    ]].copy()
-    df_full_export[DATE_COLUMN] = pd.to_datetime(df_full_export[DATE_COLUMN], errors="coerce").dt.date
-    df_full_export = df_full_export.dropna(subset=[DATE_COLUMN])
-    df_full_export.to_parquet(os.path.join(DATA_DIR, "data_full.parquet"), index=False)
-    print(f"✅ data_full.parquet guardado ({len(df_full_export):,} filas)")
-
     print("🎉 ETL completado correctamente ✅")
 
 if __name__ == "__main__":